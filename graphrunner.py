@@ -20,7 +20,90 @@
 #  IN THE SOFTWARE.
 #
 
-import unittest, subprocess, sys, argparse
+import unittest, subprocess, sys, os, re, argparse, threading, shlex, functools, heapq, json, time, tempfile, hashlib
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, DefaultDict, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+# A node in the graph is either a target name or an anonymous dependency
+Node = Union[str, Callable[[], Any]]
+
+# Dependency strings longer than this are streamed rather than split and cached
+_STREAMED_DEPS_LENGTH = 1024
+_TOKEN = re.compile(r'\S+')
+
+# Commands using any of these are left for the shell to interpret
+_SHELL_CHARS = frozenset(';&|<>$`*?~#(){}[]!\\\n')
+_SHELL_BUILTINS = frozenset(['.', 'alias', 'cd', 'command', 'eval', 'exec', 'exit', 'export', 'hash',
+	'readonly', 'set', 'shift', 'source', 'trap', 'type', 'ulimit', 'umask', 'unset', 'wait'])
+
+def _parse_command(cmd: str) -> Optional[List[str]]:
+	"""Splits a command into arguments if it can be executed without a shell, otherwise returns None"""
+	if _SHELL_CHARS.intersection(cmd):
+		return None
+
+	try:
+		args = shlex.split(cmd)
+	except ValueError:
+		return None
+
+	if not args or args[0] in _SHELL_BUILTINS or '=' in args[0]:
+		return None
+
+	return args
+
+@functools.lru_cache(maxsize=256)
+def _tokenize(deps: str) -> Tuple[str, ...]:
+	"""Splits a space delimited string of targets, caching the result for strings that are seen again"""
+	return tuple(sys.intern(dep) for dep in deps.split())
+
+def _stream_tokens(deps: str) -> Iterator[str]:
+	"""Yields the targets in a space delimited string one at a time"""
+	for match in _TOKEN.finditer(deps):
+		yield sys.intern(match.group())
+
+def _iter_tokens(deps: str) -> Iterable[str]:
+	"""Iterates over the targets in a space delimited string without building a list for long (generated) strings"""
+	if len(deps) > _STREAMED_DEPS_LENGTH:
+		return _stream_tokens(deps)
+	return _tokenize(deps)
+
+def _paths(paths: Union[str, List[str]]) -> List[str]:
+	"""Converts a space delimited string or list of file paths to a list"""
+	if isinstance(paths, str):
+		return list(_iter_tokens(paths))
+	if isinstance(paths, list):
+		return list(paths)
+	raise TypeError('paths must be a string or a list')
+
+def _load_json(path: str) -> Dict[str, Any]:
+	"""Loads a JSON object from a file, a missing or unreadable file is treated as empty"""
+	try:
+		with open(path) as f:
+			value = json.load(f)
+	except (OSError, ValueError):
+		return {}
+	return value if isinstance(value, dict) else {}
+
+def _save_json(path: str, value: Dict[str, Any]) -> None:
+	with open(path, 'w') as f:
+		json.dump(value, f, indent=1, sort_keys=True)
+
+class _UnhashableDep:
+	"""Wraps an anonymous dependency that can't be hashed so it can be used as a node in the graph"""
+
+	def __init__(self, dep: Callable[[], Any]) -> None:
+		self.dep = dep
+
+	def __call__(self) -> Any:
+		return self.dep()
+
+	def __eq__(self, other: object) -> bool:
+		return isinstance(other, _UnhashableDep) and self.dep == other.dep
+
+	def __hash__(self) -> int:
+		# Every wrapper lands in the same bucket, so they fall back to comparing with ==
+		return 0
 
 class GraphRunner:
 	"""A tool to execute functions based on a simple dependency graph
@@ -31,7 +114,7 @@ class GraphRunner:
 	A single target can be one of:
 	* A callable that requires 0 arguments
 	* None, which does nothing (useful for grouping dependencies without requiring a final action)
-	* A string, which is executed in a shell using subprocess.check_call(cmd, shell=True)
+	* A string, which is executed using subprocess.check_call(cmd) (in a shell when the command needs one)
 
 	Dependencies are defined in one of three ways:
 	* a space-delimited string of targets
@@ -40,55 +123,121 @@ class GraphRunner:
 
 	Multiple dependencies can be defined for a single target and they will be appended.
 
-	When you execute a target it's dependencies will be recursively executed before the target's action is performed.
+	When you execute a target it's dependencies will be executed before the target's action is performed.
 	Each of the dependencies will only be executed once, and the order is not guaranteed other than what is defined by the dependencies.
-	Cycles in the graph are possible, and are handled at run time (dependecies of a target are always executed before the target)
+	Cycles in the graph are possible, the targets in a cycle are executed one at a time and the dependency that closes the cycle is ignored (all other dependecies of a target are always executed before the target)
 	Missing dependencies are reported at run time (as KeyError exceptions).
 
-	"""
+	Independent targets can be executed concurrently on a pool of threads by passing jobs to execute.
+	Callables used as targets or dependencies must be thread-safe when doing so.
+	When a log_file is given, the time each target takes is saved to it and used on later runs to start
+	the targets on the longest (critical) path first.
+
+	A target can list the files it reads as inputs (and the files it creates as outputs), as a space delimited string or a list.
+	It is skipped when its inputs and command are unchanged since it last succeeded and all of its outputs exist.
+	The state of the inputs is kept in cache_file between runs.
 
-	def __init__(self):
-		self._targets = {}
-		self._deps = {}
+	"""
 
-	def target(self, name, action, deps = []):
+	def __init__(self, log_file: Optional[str] = None, cache_file: str = '.graphrunner-cache.json') -> None:
+		self._targets: Dict[str, Any] = {}
+		self._commands: Dict[str, List[str]] = {}
+		self._deps: DefaultDict[Node, List[Node]] = defaultdict(list)
+		self._dep_sets: DefaultDict[Node, Set[Node]] = defaultdict(set)
+		self._order_cache: Dict[Tuple[str, ...], List[Node]] = {}
+		self._dirty = False
+		self._sorted_targets: Optional[Tuple[str, ...]] = None
+		self._log_file = log_file
+		self._runtimes: Dict[str, float] = {}
+		if log_file is not None:
+			# Like an unreadable log file, times that aren't numbers (hand edited or stale) are ignored
+			for name, runtime in _load_json(log_file).items():
+				if isinstance(runtime, (int, float)) and not isinstance(runtime, bool):
+					self._runtimes[name] = float(runtime)
+		self._inputs: Dict[str, List[str]] = {}
+		self._outputs: Dict[str, List[str]] = {}
+		self._cache_file = cache_file
+		self._cache: Dict[str, Any] = {}
+		self._cache_loaded = False
+		self._cache_changed = False
+
+	def target(self, name: str, action: Any, deps: Any = [], inputs: Union[None, str, List[str]] = None, outputs: Union[None, str, List[str]] = None) -> None:
 		"""Adds a target to the graph"""
+		if not isinstance(name, str):
+			raise TypeError('name must be a string')
+
 		if ' ' in name:
 			raise ValueError('name may not contain spaces')
 
+		if outputs is not None and inputs is None:
+			raise ValueError('outputs may only be given with inputs')
+
+		input_paths = None if inputs is None else _paths(inputs)
+		output_paths = [] if outputs is None else _paths(outputs)
+
+		name = sys.intern(name)
 		self._targets[name] = action
-		self.depends(name, deps)
+		self._commands.pop(name, None)
+		if isinstance(action, str):
+			args = _parse_command(action)
+			if args is not None:
+				self._commands[name] = args
+
+		self._inputs.pop(name, None)
+		self._outputs.pop(name, None)
+		if input_paths is not None:
+			self._inputs[name] = input_paths
+			self._outputs[name] = output_paths
 
-	def depends(self, name, deps):
+		self._sorted_targets = None
+		self._depends(name, deps)
+
+	def depends(self, name: str, deps: Any) -> None:
 		"""Adds a dependency to the graph"""
 		if not isinstance(name, str):
 			raise TypeError('name must be a string')
 
-		if callable(deps):
-			self._add_dep(name, deps)
-		elif isinstance(deps, list):
-			for dep in deps:
-				self.depends(name, dep)
-		elif isinstance(deps, str):
-			for dep in deps.strip().split():
-				self._add_dep(name, dep)
-		else:
-			raise TypeError(str(type(deps)) + ' is not a valid dependancy type')
+		self._depends(sys.intern(name), deps)
 
-	def execute(self, names):
-		"""Executes a space delimited string or list of target names on the graph"""
+	def execute(self, names: Union[str, List[str]], jobs: Optional[int] = 1) -> None:
+		"""Executes a space delimited string or list of target names on the graph
+
+		Up to jobs targets are executed at the same time (None uses one job per CPU).
+		"""
 
 		if isinstance(names, str):
-			names = names.strip().split()
+			names = names.split()
 
 		if not isinstance(names, list):
 			raise TypeError('names must be a string or a list')
 
-		done = []
 		for name in names:
-			self._execute(name, done)
-
-	def get_deps(self, name):
+			if not isinstance(name, str):
+				raise TypeError('name must be a string')
+
+		if jobs is None:
+			jobs = os.cpu_count() or 1
+
+		if jobs < 1:
+			raise ValueError('jobs must be at least 1')
+
+		if self._inputs and not self._cache_loaded:
+			self._cache = _load_json(self._cache_file)
+			self._cache_loaded = True
+
+		try:
+			if jobs > 1:
+				self._execute_parallel(names, jobs)
+			else:
+				self._execute_serial(names)
+		finally:
+			if self._log_file is not None:
+				_save_json(self._log_file, self._runtimes)
+			if self._cache_changed:
+				_save_json(self._cache_file, self._cache)
+				self._cache_changed = False
+
+	def get_deps(self, name: str) -> List[Node]:
 		"""Retrieves a list of the dependencies for a given target"""
 		if not isinstance(name, str):
 			raise TypeError('name must be a string')
@@ -99,61 +248,309 @@ class GraphRunner:
 		if name not in self._deps:
 			return []
 
-		return self._deps[name]
+		return [dep.dep if isinstance(dep, _UnhashableDep) else dep for dep in self._deps[name]]
 
-	def get_targets(self):
+	def get_targets(self) -> List[str]:
 		"""Retrieves an alpha sorted list of all targets available on this graph"""
-		targets = self._targets.keys()
-		targets.sort()
-		return targets
-
-	targets = property(get_targets)
-
-	def _add_dep(self, name, dep):
-		if name in self._deps:
-			deps = self._deps[name]
-			if dep not in deps:
-				deps.append(dep)
+		if self._sorted_targets is None:
+			self._sorted_targets = tuple(sorted(self._targets))
+		return list(self._sorted_targets)
+
+	@property
+	def targets(self) -> List[str]:
+		"""An alpha sorted list of all targets available on this graph"""
+		return self.get_targets()
+
+	# Internal methods assume their arguments were validated by the public ones: names are interned
+	# strings and dependencies are interned strings or callables
+
+	def _depends(self, name: str, deps: Any) -> None:
+		self._dirty = True
+
+		# Nested lists are flattened with a stack, pushed in reverse to keep their order
+		stack = [deps]
+		while stack:
+			dep = stack.pop()
+			if callable(dep):
+				if type(dep).__hash__ is None:
+					dep = _UnhashableDep(dep)
+				self._add_dep(name, dep)
+			elif isinstance(dep, list):
+				stack.extend(reversed(dep))
+			elif isinstance(dep, str):
+				for token in _iter_tokens(dep):
+					self._add_dep(name, token)
+			else:
+				raise TypeError(str(type(dep)) + ' is not a valid dependancy type')
+
+	def _add_dep(self, name: str, dep: Node) -> None:
+		# The list keeps insertion order for execution, the set keeps the duplicate check O(1)
+		dep_set = self._dep_sets[name]
+		if dep not in dep_set:
+			dep_set.add(dep)
+			self._deps[name].append(dep)
+
+	def _cycles(self, roots: List[str]) -> List[List[Node]]:
+		deps_map = self._deps
+
+		# Tarjan's algorithm, run as an iterative depth first search over the graph reachable from roots
+		index: Dict[Node, int] = {}
+		lowlink: Dict[Node, int] = {}
+		finished: Dict[Node, int] = {}
+		on_stack: Set[Node] = set()
+		component: List[Node] = []
+		cycles: List[List[Node]] = []
+		for root in roots:
+			if root in index:
+				continue
+
+			index[root] = lowlink[root] = len(index)
+			component.append(root)
+			on_stack.add(root)
+			stack: List[Tuple[Node, Iterator[Node]]] = [(root, iter(deps_map.get(root, ())))]
+			while stack:
+				name, deps = stack[-1]
+				for dep in deps:
+					if dep not in index:
+						index[dep] = lowlink[dep] = len(index)
+						component.append(dep)
+						on_stack.add(dep)
+						stack.append((dep, iter(deps_map.get(dep, ()))))
+						break
+					if dep in on_stack:
+						lowlink[name] = min(lowlink[name], index[dep])
+				else:
+					stack.pop()
+					finished[name] = len(finished)
+					if stack:
+						parent = stack[-1][0]
+						lowlink[parent] = min(lowlink[parent], lowlink[name])
+
+					if lowlink[name] == index[name]:
+						# name is the first node reached in a strongly connected component, pop the whole component
+						members: List[Node] = []
+						while True:
+							member = component.pop()
+							on_stack.discard(member)
+							members.append(member)
+							if member == name:
+								break
+
+						# Members are executed in the order the depth first search finished them
+						if len(members) > 1:
+							members.sort(key=finished.__getitem__)
+							cycles.append(members)
+
+		return cycles
+
+	def _graph(self, roots: List[str]) -> Tuple[List[Node], Dict[Node, int], Dict[Node, List[Node]]]:
+		targets = self._targets
+		deps_map = self._deps
+		cycles = self._cycles(roots)
+		cycle_of: Dict[Node, int] = {}
+		for i, members in enumerate(cycles):
+			for member in members:
+				cycle_of[member] = i
+
+		# Walk the graph reachable from roots, recording edges from each dependency to its dependents
+		nodes: List[Node] = []
+		in_degree: Dict[Node, int] = {}
+		for root in roots:
+			if root not in targets:
+				raise KeyError(root + ' is not a valid target')
+			if root not in in_degree:
+				in_degree[root] = 0
+				nodes.append(root)
+
+		successors: Dict[Node, List[Node]] = {}
+		queue = deque(nodes)
+		while queue:
+			name = queue.popleft()
+			cycle = cycle_of.get(name) if cycle_of else None
+			for dep in deps_map.get(name, ()):
+				if dep not in in_degree:
+					if not callable(dep) and dep not in targets:
+						raise KeyError(dep + ' is not a valid target')
+					in_degree[dep] = 0
+					nodes.append(dep)
+					queue.append(dep)
+				if dep == name or (cycle is not None and cycle_of.get(dep) == cycle):
+					continue
+				successors.setdefault(dep, []).append(name)
+				in_degree[name] += 1
+
+		# Edges inside a cycle are replaced with a chain that runs its members one after another
+		for members in cycles:
+			for i in range(1, len(members)):
+				successors.setdefault(members[i - 1], []).append(members[i])
+				in_degree[members[i]] += 1
+
+		return nodes, in_degree, successors
+
+	def _toposort(self, roots: List[str]) -> List[Node]:
+		nodes, in_degree, successors = self._graph(roots)
+		return self._order(nodes, in_degree, successors)
+
+	def _order(self, nodes: List[Node], in_degree: Dict[Node, int], successors: Dict[Node, List[Node]]) -> List[Node]:
+		# Kahn's algorithm: repeatedly emit the nodes that have no unfinished dependencies
+		remaining = dict(in_degree)
+		ready = deque([node for node in nodes if remaining[node] == 0])
+		order: List[Node] = []
+		while ready:
+			node = ready.popleft()
+			order.append(node)
+			for succ in successors.get(node, ()):
+				remaining[succ] -= 1
+				if remaining[succ] == 0:
+					ready.append(succ)
+
+		return order
+
+	def _execute_serial(self, names: List[str]) -> None:
+		if self._dirty:
+			self._order_cache.clear()
+			self._dirty = False
+
+		key = tuple(names)
+		if key in self._order_cache:
+			order = self._order_cache[key]
 		else:
-			self._deps[name] = [dep]
-
-	def _execute(self, name, done):
-		if not isinstance(name, str):
-			raise TypeError('name must be a string')
-
-		if name not in self._targets:
-			raise KeyError(name + ' is not a valid target')
-
-		if name in done:
+			order = self._order_cache[key] = self._toposort(names)
+
+		execute_node = self._execute
+		for node in order:
+			execute_node(node)
+
+	def _execute_parallel(self, names: List[str], jobs: int) -> None:
+		nodes, in_degree, successors = self._graph(names)
+
+		# The priority of a node is the logged time of the longest path from it to a requested target
+		runtimes = self._runtimes
+		priority: Dict[Node, float] = {}
+		for node in reversed(self._order(nodes, in_degree, successors)):
+			longest = max([priority[succ] for succ in successors.get(node, ())], default=0.0)
+			priority[node] = runtimes.get(node, 0.0) + longest if isinstance(node, str) else longest
+
+		# Same as Kahn's algorithm, but the ready node with the highest priority is emitted to the pool
+		# as soon as a worker is free (ties are broken by discovery order)
+		position = {node: i for i, node in enumerate(nodes)}
+		ready = [(-priority[node], position[node]) for node in nodes if in_degree[node] == 0]
+		heapq.heapify(ready)
+		running: Dict['Future[None]', Node] = {}
+		with ThreadPoolExecutor(max_workers=jobs) as executor:
+			while ready or running:
+				while ready and len(running) < jobs:
+					node = nodes[heapq.heappop(ready)[1]]
+					running[executor.submit(self._execute, node)] = node
+
+				finished, _ = wait(running, return_when=FIRST_COMPLETED)
+				for future in finished:
+					node = running.pop(future)
+					future.result()
+					for succ in successors.get(node, ()):
+						in_degree[succ] -= 1
+						if in_degree[succ] == 0:
+							heapq.heappush(ready, (-priority[succ], position[succ]))
+
+	def _execute(self, node: Node) -> None:
+		# Anonymous dependencies are not targets, they are their own action
+		if not isinstance(node, str):
+			node()
 			return
 
-		done.append(name)
-
-		if name in self._deps:
-			deps = self._deps[name]
-			for dep in deps:
-				if callable(dep):
-					if dep not in done:
-						done.append(dep)
-						dep()
-				else:
-					self._execute(dep, done)
+		action = self._targets[node]
+		inputs = self._inputs.get(node)
+		if inputs is not None:
+			state = self._input_state(node, action, inputs)
+			if self._up_to_date(node, state):
+				return
 
-		action = self._targets[name]
+		start = time.perf_counter()
 
-		if isinstance(action, str):
-			subprocess.check_call(action, shell=True)
+		if action is None:
+			pass
 		elif callable(action):
 			action()
-		elif action is None:
-			pass
+		elif isinstance(action, str):
+			args = self._commands.get(node)
+			if args is None:
+				subprocess.check_call(action, shell=True)
+			else:
+				try:
+					subprocess.check_call(args)
+				except OSError:
+					# Not an executable (e.g. a builtin the list doesn't know about), let the shell decide
+					subprocess.check_call(action, shell=True)
 		else:
-			raise TypeError(name + ' is not a valid target type')
-
-	def execute_as_commandline(self, args = sys.argv, parser = argparse.ArgumentParser()):
+			raise TypeError(node + ' is not a valid target type')
+
+		self._runtimes[node] = time.perf_counter() - start
+
+		if inputs is not None:
+			self._cache[node] = state
+			self._cache_changed = True
+
+	def _cache_entry(self, name: str) -> Optional[Dict[str, Any]]:
+		# Like an unreadable cache file, an entry that isn't an object (hand edited or stale) is treated as missing
+		entry = self._cache.get(name)
+		return entry if isinstance(entry, dict) else None
+
+	def _input_state(self, name: str, action: Any, inputs: List[str]) -> Dict[str, Any]:
+		# Size and modification time are a fast check, the hash is only computed when they change
+		stats: Dict[str, List[int]] = {}
+		for path in inputs:
+			st = os.stat(path)
+			stats[path] = [st.st_size, st.st_mtime_ns]
+		state: Dict[str, Any] = {'command': action if isinstance(action, str) else None, 'stats': stats}
+
+		entry = self._cache_entry(name)
+		if entry is not None and entry.get('command') == state['command'] and entry.get('stats') == stats:
+			state['hash'] = entry.get('hash')
+			return state
+
+		digest = hashlib.blake2b()
+		for path in inputs:
+			digest.update((path + '\0' + str(stats[path][0]) + '\0').encode())
+			with open(path, 'rb') as f:
+				for chunk in iter(lambda: f.read(65536), b''):
+					digest.update(chunk)
+		state['hash'] = digest.hexdigest()
+		return state
+
+	def _up_to_date(self, name: str, state: Dict[str, Any]) -> bool:
+		entry = self._cache_entry(name)
+		if entry is None or entry.get('command') != state['command'] or entry.get('hash') != state['hash']:
+			return False
+
+		for path in self._outputs.get(name, ()):
+			if not os.path.exists(path):
+				return False
+
+		# The hash matched, remember the new modification times so the next check is a fast one
+		if entry.get('stats') != state['stats']:
+			self._cache[name] = state
+			self._cache_changed = True
+		return True
+
+	def execute_as_commandline(self, args: List[str] = sys.argv, parser: Optional[argparse.ArgumentParser] = None) -> None:
+		if parser is None:
+			parser = argparse.ArgumentParser()
 		parser.add_argument('targets', nargs='*', help='Targets to execute')
-		args = parser.parse_args()
-		self.execute(args.targets)
+		parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of targets to execute at the same time')
+		options = parser.parse_args()
+		self.execute(options.targets, options.jobs)
+
+class _UnhashableAction:
+	"""An anonymous dependency that can't be hashed, defining __eq__ without __hash__ sets __hash__ to None"""
+
+	def __init__(self, test: Any) -> None:
+		self.test = test
+
+	def __eq__(self, other: object) -> bool:
+		return isinstance(other, _UnhashableAction) and self.test is other.test
+
+	def __call__(self) -> None:
+		self.test.target()
 
 class GraphRunnerTestCase(unittest.TestCase):
 	"""Unit tests for the GraphRunner class"""
@@ -173,6 +570,10 @@ class GraphRunnerTestCase(unittest.TestCase):
 		with self.assertRaises(ValueError):
 			self.harness.target('target with space', self.target)
 
+	def test_add_target_invalid_name(self):
+		with self.assertRaises(TypeError):
+			self.harness.target(5, self.target)
+
 	def test_execute(self):
 		self.harness.target('target', self.target)
 		self.harness.execute('target')
@@ -205,6 +606,21 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.harness.execute('target')
 		self.assertEquals(self.targetCalled, 4)
 
+	def test_long_string_dep(self):
+		names = ['target' + str(i) for i in range(1000)]
+		self.harness.target('target', self.target, '  ' + ' \n'.join(names) + '\t')
+		self.assertEqual(self.harness.get_deps('target'), names)
+
+	def test_nested_list_dep_order(self):
+		self.harness.target('target', self.target)
+		self.harness.depends('target', ['target2', ['target3 target4', [self.target]], 'target5'])
+		self.assertEqual(self.harness.get_deps('target'), ['target2', 'target3', 'target4', self.target, 'target5'])
+
+	def test_invalid_dep(self):
+		self.harness.target('target', self.target)
+		with self.assertRaises(TypeError):
+			self.harness.depends('target', ['target2', 5])
+
 	def test_execute_list_dep_simple_syntax(self):
 		self.harness.target('target2', self.target)
 		self.harness.target('target3', self.target)
@@ -220,6 +636,22 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.harness.execute('target')
 		self.assertEquals(self.targetCalled, 3)
 
+	def test_add_dup_dep(self):
+		self.harness.target('target', self.target)
+		self.harness.target('target2', self.target)
+		self.harness.depends('target', 'target2 target2')
+		self.harness.depends('target', ['target2', self.target, self.target])
+		self.assertEqual(self.harness.get_deps('target'), ['target2', self.target])
+
+	def test_execute_unhashable_dep(self):
+		self.harness.target('target', None, _UnhashableAction(self))
+		self.harness.target('target2', self.target, ['target', _UnhashableAction(self), _UnhashableAction(self)])
+		self.assertEqual(self.harness.get_deps('target2'), ['target', _UnhashableAction(self)])
+		self.harness.execute('target2')
+		self.assertEqual(self.targetCalled, 2)
+		self.harness.execute('target2', jobs=2)
+		self.assertEqual(self.targetCalled, 4)
+
 	def test_execute_dup_dep(self):
 		self.harness.target('target', self.target)
 		self.harness.target('target2', self.target)
@@ -243,6 +675,22 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.harness.target('target', 'echo test')
 		self.harness.execute('target')
 
+	def test_parse_command(self):
+		self.harness.target('target', 'echo "test target"')
+		self.harness.target('target2', 'echo $HOME')
+		self.harness.target('target3', 'cd ..')
+		self.assertEqual(self.harness._commands, {'target': ['echo', 'test target']})
+		self.harness.target('target', 'echo test > /dev/null')
+		self.assertEqual(self.harness._commands, {})
+
+	def test_execute_command_failure(self):
+		self.harness.target('target', 'false')
+		self.harness.target('target2', 'exit 1')
+		with self.assertRaises(subprocess.CalledProcessError):
+			self.harness.execute('target')
+		with self.assertRaises(subprocess.CalledProcessError):
+			self.harness.execute('target2')
+
 	def test_execute_string_dep_in_target(self):
 		self.harness.target('target', self.target)
 		self.harness.target('target2', self.target, 'target')
@@ -274,6 +722,14 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.assertEquals(self.targetCalled, 1)
 		self.assertEquals(target1_complete['value'], True)
 
+	def test_deep_dep_chain(self):
+		depth = sys.getrecursionlimit() * 2
+		self.harness.target('target0', self.target)
+		for i in range(1, depth):
+			self.harness.target('target' + str(i), self.target, 'target' + str(i - 1))
+		self.harness.execute('target' + str(depth - 1))
+		self.assertEqual(self.targetCalled, depth)
+
 	def test_get_targets(self):
 		self.harness.target('target1', None)
 		self.harness.target('target2', self.target)
@@ -284,6 +740,15 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.assertIn('target2', targets)
 		self.assertIn('target3', targets)
 
+	def test_get_targets_sorted(self):
+		self.harness.target('target2', None)
+		self.harness.target('target1', None)
+		self.assertEqual(self.harness.targets, ['target1', 'target2'])
+		self.harness.target('target0', None)
+		self.assertEqual(self.harness.targets, ['target0', 'target1', 'target2'])
+		self.harness.targets.append('target3')
+		self.assertEqual(self.harness.targets, ['target0', 'target1', 'target2'])
+
 	def test_circular_dep(self):
 		self.harness.target('target', self.target)
 		self.harness.target('target2', self.target)
@@ -292,6 +757,22 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.harness.execute('target')
 		self.assertEquals(self.targetCalled, 2)
 
+	def test_circular_dep_order(self):
+		completed = []
+		self.harness.target('target', lambda : completed.append('target'), 'target2')
+		self.harness.target('target2', lambda : completed.append('target2'), 'target3')
+		self.harness.target('target3', lambda : completed.append('target3'), 'target')
+		self.harness.execute('target')
+		self.assertEqual(completed, ['target3', 'target2', 'target'])
+
+	def test_cycles(self):
+		self.harness.target('target', None, 'target2 target4')
+		self.harness.target('target2', None, 'target3')
+		self.harness.target('target3', None, 'target target4')
+		self.harness.target('target4', None, 'target5')
+		self.harness.target('target5', None, 'target4 target5')
+		self.assertEqual(self.harness._cycles(['target']), [['target5', 'target4'], ['target3', 'target2', 'target']])
+
 	def test_missing_dep(self):
 		self.harness.target('target', self.target)
 		self.harness.depends('target', 'target2')
@@ -311,6 +792,26 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.harness.execute('target')
 		self.assertEquals(self.targetCalled, 4) # 3 unique named targets and 1 unique anonymous dependency
 
+	def test_execute_repeated(self):
+		self.harness.target('target', self.target)
+		self.harness.target('target2', self.target, 'target')
+		self.harness.execute('target2')
+		self.harness.execute('target2')
+		self.assertEqual(self.targetCalled, 4)
+		self.harness.target('target3', self.target)
+		self.harness.depends('target2', 'target3')
+		self.harness.execute('target2')
+		self.assertEqual(self.targetCalled, 7)
+
+	def test_execute_once_shared_callable(self):
+		# Each access to self.target creates a new bound method, equal ones must still only run once
+		self.harness.target('target', None)
+		for i in range(1, 50):
+			self.harness.target('target' + str(i), None, self.target)
+			self.harness.depends('target', 'target' + str(i))
+		self.harness.execute('target')
+		self.assertEqual(self.targetCalled, 1)
+
 	def test_execute_multiple(self):
 		self.harness.target('target', self.target)
 		self.harness.target('target2', self.target)
@@ -318,6 +819,176 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.harness.execute(['target', 'target2', 'target3'])
 		self.assertEquals(self.targetCalled, 3)
 
+	def test_execute_parallel(self):
+		barrier = threading.Barrier(2, timeout=5)
+		self.harness.target('target', barrier.wait)
+		self.harness.target('target2', barrier.wait)
+		self.harness.target('target3', self.target, 'target target2')
+		self.harness.execute('target3', jobs=2)
+		self.assertEqual(self.targetCalled, 1)
+
+	def test_execute_parallel_dep_order(self):
+		lock = threading.Lock()
+		completed = []
+
+		def complete(name):
+			def action():
+				with lock:
+					completed.append(name)
+			return action
+
+		self.harness.target('target', complete('target'))
+		self.harness.target('target2', complete('target2'), 'target')
+		self.harness.target('target3', complete('target3'), 'target')
+		self.harness.target('target4', complete('target4'), 'target2 target3')
+		self.harness.execute('target4', jobs=4)
+		self.assertEqual(completed[0], 'target')
+		self.assertEqual(sorted(completed[1:3]), ['target2', 'target3'])
+		self.assertEqual(completed[3], 'target4')
+
+	def test_execute_parallel_circular_dep(self):
+		self.harness.target('target', self.target)
+		self.harness.target('target2', self.target)
+		self.harness.depends('target', 'target2')
+		self.harness.depends('target2', 'target')
+		self.harness.execute('target', jobs=2)
+		self.assertEqual(self.targetCalled, 2)
+
+	def test_execute_parallel_failure(self):
+		def fail():
+			raise RuntimeError('failed')
+
+		self.harness.target('target', fail)
+		self.harness.target('target2', self.target, 'target')
+		with self.assertRaises(RuntimeError):
+			self.harness.execute('target2', jobs=2)
+		self.assertEqual(self.targetCalled, 0)
+
+	def test_execute_parallel_critical_path(self):
+		lock = threading.Lock()
+		barrier = threading.Barrier(2, timeout=5)
+		started = []
+
+		def start(name, wait=False):
+			def action():
+				with lock:
+					started.append(name)
+				if wait:
+					barrier.wait()
+			return action
+
+		# target3 leads the longest path and target2 is next, both must be running before anything else starts
+		self.harness.target('target', start('target'))
+		self.harness.target('target2', start('target2', True))
+		self.harness.target('target3', start('target3', True))
+		self.harness.target('target4', start('target4'), 'target3')
+		self.harness.target('all', None, 'target target2 target4')
+		self.harness._runtimes = {'target': 1.0, 'target2': 2.0, 'target3': 0.5, 'target4': 2.0}
+		self.harness.execute('all', jobs=2)
+		self.assertEqual(sorted(started[:2]), ['target2', 'target3'])
+		self.assertEqual(len(started), 4)
+
+	def test_log_file(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			log_file = os.path.join(tmp, '.graphrunner.log')
+			harness = GraphRunner(log_file)
+			harness.target('target', self.target)
+			harness.target('target2', self.target, ['target', self.target])
+			harness.execute('target2')
+			with open(log_file) as f:
+				self.assertEqual(sorted(json.load(f)), ['target', 'target2'])
+			self.assertEqual(sorted(GraphRunner(log_file)._runtimes), ['target', 'target2'])
+
+	def test_execute_incremental(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			source = os.path.join(tmp, 'source')
+			output = os.path.join(tmp, 'output')
+			cache_file = os.path.join(tmp, 'cache.json')
+
+			def build():
+				self.target()
+				with open(output, 'w') as f:
+					f.write('built')
+
+			with open(source, 'w') as f:
+				f.write('source')
+			harness = GraphRunner(cache_file=cache_file)
+			harness.target('target', build, inputs=[source], outputs=[output])
+			harness.execute('target')
+			harness.execute('target')
+			self.assertEqual(self.targetCalled, 1)
+
+			# A new runner reads the cache, a changed modification time alone doesn't trigger a build
+			os.utime(source, ns=(0, 0))
+			harness = GraphRunner(cache_file=cache_file)
+			harness.target('target', build, inputs=[source], outputs=[output])
+			harness.execute('target')
+			self.assertEqual(self.targetCalled, 1)
+
+			with open(source, 'w') as f:
+				f.write('changed')
+			harness.execute('target')
+			self.assertEqual(self.targetCalled, 2)
+
+			os.remove(output)
+			harness.execute('target')
+			self.assertEqual(self.targetCalled, 3)
+
+	def test_target_inputs(self):
+		self.harness.target('target', None, inputs='source  other', outputs=['output'])
+		self.assertEqual(self.harness._inputs['target'], ['source', 'other'])
+		self.assertEqual(self.harness._outputs['target'], ['output'])
+		with self.assertRaises(ValueError):
+			self.harness.target('target2', None, outputs='output')
+		with self.assertRaises(TypeError):
+			self.harness.target('target2', None, inputs=5)
+		self.assertEqual(self.harness.targets, ['target'])
+
+	def test_execute_incremental_invalid_cache(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			source = os.path.join(tmp, 'source')
+			cache_file = os.path.join(tmp, 'cache.json')
+			with open(source, 'w') as f:
+				f.write('source')
+			with open(cache_file, 'w') as f:
+				json.dump({'target': 'stale'}, f)
+
+			harness = GraphRunner(cache_file=cache_file)
+			harness.target('target', self.target, inputs=[source])
+			harness.execute('target')
+			harness.execute('target')
+			self.assertEqual(self.targetCalled, 1)
+
+	def test_execute_invalid_log_file(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			log_file = os.path.join(tmp, '.graphrunner.log')
+			with open(log_file, 'w') as f:
+				json.dump({'target': 'x', 'target2': 2, 'target3': True}, f)
+
+			harness = GraphRunner(log_file)
+			self.assertEqual(harness._runtimes, {'target2': 2.0})
+			harness.target('target', self.target)
+			harness.target('target2', self.target)
+			harness.target('target3', self.target, 'target target2')
+			harness.execute('target3', jobs=2)
+			self.assertEqual(self.targetCalled, 3)
+
+	def test_execute_incremental_command(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			source = os.path.join(tmp, 'source')
+			log = os.path.join(tmp, 'log')
+			with open(source, 'w') as f:
+				f.write('source')
+
+			harness = GraphRunner(cache_file=os.path.join(tmp, 'cache.json'))
+			harness.target('target', 'echo first >> ' + log, inputs=[source])
+			harness.execute('target')
+			harness.execute('target')
+			harness.target('target', 'echo second >> ' + log, inputs=[source])
+			harness.execute('target')
+			with open(log) as f:
+				self.assertEqual(f.read().split(), ['first', 'second'])
+
 	def test_execute_as_commandline(self):
 		self.harness.target('target1', self.target)
 		self.harness.target('target2', self.target)
@@ -326,6 +997,18 @@ class GraphRunnerTestCase(unittest.TestCase):
 		self.harness.execute_as_commandline()
 		self.assertEquals(self.targetCalled, 2)
 
+	def test_execute_as_commandline_twice(self):
+		argv = sys.argv
+		sys.argv = ['graphrunner.py', '-j', '2', 'target1', 'target2']
+		try:
+			for harness in [self.harness, GraphRunner(), self.harness]:
+				harness.target('target1', self.target)
+				harness.target('target2', self.target)
+				harness.execute_as_commandline()
+		finally:
+			sys.argv = argv
+		self.assertEqual(self.targetCalled, 6)
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -1,4 +1,11 @@
-from distutils.core import setup
+from setuptools import setup
+
+# Compile the module to a C extension when mypyc is available, the pure Python module is used otherwise
+try:
+	from mypyc.build import mypycify
+	ext_modules = mypycify(['graphrunner.py'])
+except ImportError:
+	ext_modules = []
 
 setup(
 	name="GraphRunner", 
@@ -8,4 +15,5 @@ setup(
 	author_email="sam@luceva.net",
 	url="http://github.com/oneam/graphrunner",
 	py_modules=["graphrunner"],
+	ext_modules=ext_modules,
 	)
\ No newline at end of file